@@ -0,0 +1,102 @@
+"""Shared helpers for the Python benchmark scripts"""
+
+import asyncio
+import json
+import os
+import sys
+
+try:
+    import websockets
+except ImportError:
+    print("Installing websockets...")
+    import subprocess
+
+    subprocess.check_call([sys.executable, "-m", "pip", "install", "websockets", "-q"])
+    import websockets
+
+try:
+    import orjson
+
+    def _dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+
+except ImportError:
+
+    def _dumps(obj):
+        return json.dumps(obj, indent=2).encode()
+
+
+if sys.platform != "win32":
+    try:
+        import uvloop
+
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+
+HOST = os.environ.get("HOST") or "localhost"
+PORT = int(os.environ.get("BENCH_PORT") or os.environ.get("PORT") or 7682)
+URI = f"ws://{HOST}:{PORT}/ws"
+BENCH_CPU = os.environ.get("BENCH_CPU")
+
+# recv() hands back already-buffered frames without suspending, so a bulk
+# receive loop never yields during a long burst. Loops await asyncio.sleep(0)
+# every YIELD_EVERY frames to let timers and other tasks run.
+YIELD_EVERY = 64
+
+
+def pin_client_cpu():
+    """Pin this process to the CPU named by BENCH_CPU, if set"""
+    if BENCH_CPU and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {int(BENCH_CPU)})
+
+
+def write_result(result):
+    """Write a benchmark result as indented JSON to stdout in one write"""
+    # Flush any pending text-layer output first so ordering is preserved
+    sys.stdout.flush()
+    sys.stdout.buffer.write(_dumps(result) + b"\n")
+    sys.stdout.buffer.flush()
+
+
+def connect(max_size=2**20):
+    """Open a ttyd WebSocket to the benchmark server.
+
+    permessage-deflate is disabled so throughput measures the wire rather than
+    client-side zlib inflate, and a deep receive queue keeps bursts from
+    back-pressuring the reader.
+    """
+    return websockets.connect(
+        URI,
+        subprotocols=["tty"],
+        max_size=max_size,
+        compression=None,
+        max_queue=2**16,
+    )
+
+
+# Init frame for the default 80x24 terminal, constant-folded from json.dumps()
+INIT_PAYLOAD = b'{"AuthToken": "", "columns": 80, "rows": 24}'
+
+
+async def send_init(ws):
+    """Send the init frame that starts the PTY session"""
+    await ws.send(INIT_PAYLOAD)
+
+
+async def await_prompt(ws, timeout=10.0):
+    """Wait for an output frame containing a shell prompt character.
+
+    Gives up silently after `timeout` seconds, so a prompt we fail to
+    recognise only delays the benchmark instead of aborting it.
+    """
+    recv = ws.recv
+    try:
+        async with asyncio.timeout(timeout):
+            while True:
+                msg = await recv()
+                if type(msg) is bytes and msg[:1] == b"0":
+                    if b"$" in msg or b"%" in msg or b"#" in msg:
+                        return
+    except asyncio.TimeoutError:
+        pass
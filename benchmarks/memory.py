@@ -2,47 +2,102 @@
 """Memory benchmark: measures server RSS under sustained large output"""
 
 import asyncio
-import json
-import sys
+import os
 import subprocess
-import time
 
-try:
-    import websockets
-except ImportError:
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "websockets", "-q"])
-    import websockets
+from _common import (
+    PORT,
+    YIELD_EVERY,
+    await_prompt,
+    connect,
+    pin_client_cpu,
+    send_init,
+    write_result,
+)
 
-HOST = "localhost"
-PORT = 7682
+CMD_PAYLOAD = bytes([0x30]) + b"head -c 5000000 /dev/zero | xxd\r"
 
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
 
-def get_server_rss_mb():
-    """Get RSS of rust-terminal process in MB"""
+_server_pid = None
+
+
+def find_server_pid():
+    """Find the PID of the rust-terminal server listening on PORT"""
     try:
         result = subprocess.run(
-            ["pgrep", "-f", "rust-terminal"], capture_output=True, text=True
+            ["pgrep", "-f", f"rust-terminal.*--port {PORT}"],
+            capture_output=True,
+            text=True,
         )
-        pids = result.stdout.strip().split("\n")
-        if not pids or not pids[0]:
-            return None
-        pid = pids[0]
-        rss_result = subprocess.run(
-            ["ps", "-o", "rss=", "-p", pid], capture_output=True, text=True
-        )
-        rss_kb = int(rss_result.stdout.strip())
-        return rss_kb / 1024
+        pids = result.stdout.split()
+        return int(pids[0]) if pids else None
     except Exception:
         return None
 
 
-async def run_benchmark():
-    uri = f"ws://{HOST}:{PORT}/ws"
+def server_pid():
+    """Cached PID of the rust-terminal server on PORT, or None"""
+    global _server_pid
+    # Resolve the PID once; steady-state samples only read /proc (no fork/exec)
+    if _server_pid is None:
+        _server_pid = find_server_pid()
+    return _server_pid
+
+
+def get_server_rss_mb():
+    """Get RSS of rust-terminal process in MB"""
+    global _server_pid
+    if server_pid() is None:
+        return None
+    try:
+        with open(f"/proc/{_server_pid}/statm", "rb") as f:
+            rss_pages = int(f.read().split()[1])
+    except OSError:
+        # Process exited or was replaced; look it up again on the next sample
+        _server_pid = None
+        return None
+    return rss_pages * PAGE_SIZE / (1024 * 1024)
+
+
+def reset_server_peak_rss():
+    """Reset the VmHWM high-water mark of rust-terminal; False if not possible"""
+    pid = server_pid()
+    if pid is None:
+        return False
+    try:
+        # "5" resets the peak RSS counter (Linux >= 4.0, same user suffices)
+        with open(f"/proc/{pid}/clear_refs", "wb") as f:
+            f.write(b"5")
+    except OSError:
+        return False
+    return True
+
+
+def get_server_peak_rss_mb():
+    """Get peak RSS (VmHWM) of rust-terminal process in MB"""
+    pid = server_pid()
+    if pid is None:
+        return None
+    try:
+        with open(f"/proc/{pid}/status", "rb") as f:
+            for line in f:
+                if line.startswith(b"VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+async def bench(ws):
+    """Run the memory test on a session sitting at a shell prompt"""
     rss_samples = []
 
     initial_rss = get_server_rss_mb()
     if initial_rss:
         rss_samples.append(initial_rss)
+    # VmHWM covers the server's whole lifetime; restart it so the peak is ours
+    peak_reset = reset_server_peak_rss()
 
     async def sample_rss():
         while True:
@@ -54,65 +109,58 @@ async def run_benchmark():
     sampler_task = asyncio.create_task(sample_rss())
 
     try:
-        async with websockets.connect(
-            uri, subprotocols=["tty"], max_size=20 * 1024 * 1024
-        ) as ws:
-            init = json.dumps({"AuthToken": "", "columns": 80, "rows": 24})
-            await ws.send(init.encode())
-
-            async def wait_for_prompt():
-                while True:
-                    msg = await ws.recv()
-                    if isinstance(msg, bytes) and len(msg) > 1 and msg[0] == 0x30:
-                        text = msg[1:].decode("utf-8", errors="replace")
-                        if "$" in text or "%" in text or "#" in text:
-                            break
-
-            try:
-                await asyncio.wait_for(wait_for_prompt(), timeout=10)
-            except asyncio.TimeoutError:
-                pass
-
-            cmd = "head -c 5000000 /dev/zero | xxd\r"
-            payload = bytes([0x30]) + cmd.encode()
-            await ws.send(payload)
-
-            bytes_received = 0
-
-            async def collect_output():
-                nonlocal bytes_received
-                while True:
-                    msg = await ws.recv()
-                    if isinstance(msg, bytes) and len(msg) > 1 and msg[0] == 0x30:
-                        bytes_received += len(msg) - 1
-                        text = msg[1:].decode("utf-8", errors="replace")
-                        if bytes_received > 4_000_000:
-                            break
-
-            try:
-                await asyncio.wait_for(collect_output(), timeout=15)
-            except asyncio.TimeoutError:
-                pass
-
-            await asyncio.sleep(1)
-
-    except asyncio.TimeoutError:
-        pass
+        await ws.send(CMD_PAYLOAD)
+
+        bytes_received = 0
+
+        async def collect_output():
+            nonlocal bytes_received
+            recv = ws.recv
+            bytes_type = bytes
+            frames = 0
+            while True:
+                msg = await recv()
+                # Yield periodically so the RSS sampler runs during bursts
+                frames += 1
+                if frames % YIELD_EVERY == 0:
+                    await asyncio.sleep(0)
+                if type(msg) is bytes_type and msg[:1] == b"0":
+                    bytes_received += len(msg) - 1
+                    if bytes_received > 4_000_000:
+                        break
+
+        try:
+            await asyncio.wait_for(collect_output(), timeout=15)
+        except asyncio.TimeoutError:
+            pass
+
+        await asyncio.sleep(1)
     finally:
         sampler_task.cancel()
 
+    # The kernel's high-water mark catches peaks that fall between samples;
+    # without a reset it may predate this test, so fall back to the samples
+    peak_rss = get_server_peak_rss_mb() if peak_reset else None
+
     if rss_samples:
-        result = {
+        return {
             "test": "memory",
             "initial_rss_mb": round(rss_samples[0], 1) if rss_samples else None,
-            "peak_rss_mb": round(max(rss_samples), 1),
+            "peak_rss_mb": round(peak_rss or max(rss_samples), 1),
             "final_rss_mb": round(rss_samples[-1], 1),
             "samples": len(rss_samples),
         }
-        print(json.dumps(result, indent=2))
-    else:
-        print(json.dumps({"error": "no RSS samples collected"}))
+    return {"error": "no RSS samples collected"}
+
+
+async def run_benchmark():
+    async with connect(max_size=20 * 1024 * 1024) as ws:
+        await send_init(ws)
+        await await_prompt(ws)
+        result = await bench(ws)
+    write_result(result)
 
 
 if __name__ == "__main__":
+    pin_client_cpu()
     asyncio.run(run_benchmark())
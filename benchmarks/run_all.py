@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""Runs the latency, throughput and memory benchmarks over one WebSocket session"""
+
+import asyncio
+
+import latency
+import memory
+import throughput
+from _common import await_prompt, connect, pin_client_cpu, send_init, write_result
+
+
+async def main():
+    # One handshake and one shell for all three tests; each bench() leaves
+    # the session at a prompt (memory runs last since it does not wait for one)
+    async with connect(max_size=20 * 1024 * 1024) as ws:
+        await send_init(ws)
+        await await_prompt(ws)
+        for bench in (latency.bench, throughput.bench, memory.bench):
+            write_result(await bench(ws))
+
+
+if __name__ == "__main__":
+    pin_client_cpu()
+    asyncio.run(main())
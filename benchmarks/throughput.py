@@ -2,113 +2,115 @@
 """Throughput benchmark: measures MB/s for large output (seq 1 500000)"""
 
 import asyncio
-import json
+import re
 import time
-import sys
 
-try:
-    import websockets
-except ImportError:
-    print("Installing websockets...")
-    import subprocess
+from _common import (
+    YIELD_EVERY,
+    await_prompt,
+    connect,
+    pin_client_cpu,
+    send_init,
+    write_result,
+)
 
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "websockets", "-q"])
-    import websockets
+CMD_PAYLOAD = bytes([0x30]) + b"yes | head -c 3000000\r"
+# A line ending in a shell prompt character (command finished)
+PROMPT_RE = re.compile(rb"[$%#][ \t\r]*$", re.M)
 
-HOST = "localhost"
-PORT = 7682
 
-
-async def run_benchmark():
-    uri = f"ws://{HOST}:{PORT}/ws"
+async def bench(ws):
+    """Run the throughput test on a session sitting at a shell prompt"""
     total_bytes = 0
-    start_time = None
     end_time = None
-    prompt_count = 0
-
-    async with websockets.connect(
-        uri, subprotocols=["tty"], max_size=10 * 1024 * 1024
-    ) as ws:
-        # Send init
-        init = json.dumps({"AuthToken": "", "columns": 80, "rows": 24})
-        await ws.send(init.encode())
-
-        # Wait for initial prompt
-        async def wait_for_prompt():
-            nonlocal prompt_count
-            while True:
-                msg = await ws.recv()
-                if isinstance(msg, bytes) and len(msg) > 1 and msg[0] == 0x30:
-                    text = msg[1:].decode("utf-8", errors="replace")
-                    if "$" in text or "%" in text or "#" in text:
-                        prompt_count += 1
-                        if prompt_count >= 1:
-                            break
-
-        try:
-            await asyncio.wait_for(wait_for_prompt(), timeout=10)
-        except asyncio.TimeoutError:
-            pass
-
-        # Send throughput command
-        cmd = "yes | head -c 3000000\r"
-        payload = bytes([0x30]) + cmd.encode()
-        start_time = time.perf_counter()
-        await ws.send(payload)
-
-        # Collect all output
-        async def collect_output():
-            nonlocal total_bytes, end_time
-            idle_count = 0
-            while True:
-                try:
-                    msg = await asyncio.wait_for(ws.recv(), timeout=3)
-                    idle_count = 0
-                except asyncio.TimeoutError:
-                    idle_count += 1
-                    if idle_count >= 2 and total_bytes > 50_000:
-                        # No data for 6 seconds and we have some data
-                        end_time = time.perf_counter()
-                        return
-                    continue
-
-                if isinstance(msg, bytes) and len(msg) > 1 and msg[0] == 0x30:
-                    data = msg[1:]
-                    total_bytes += len(data)
-                    text = data.decode("utf-8", errors="replace")
-                    # Detect prompt return (command finished)
-                    lines = text.split("\n")
-                    for line in lines:
-                        line = line.strip()
-                        if (
-                            line.endswith("$")
-                            or line.endswith("%")
-                            or line.endswith("#")
-                        ):
-                            if total_bytes > 50_000:
-                                end_time = time.perf_counter()
-                                return
-
-        try:
-            await asyncio.wait_for(collect_output(), timeout=60)
-        except asyncio.TimeoutError:
-            end_time = time.perf_counter()
-
-    if start_time and end_time and total_bytes > 50_000:
+
+    # Send throughput command
+    start_time = time.perf_counter()
+    await ws.send(CMD_PAYLOAD)
+
+    # Collect all output. Frames are read with a bare recv(); one watchdog
+    # timer, scheduled relative to the last frame, handles idle detection
+    # instead of a wait_for() per frame.
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    last_frame = loop.time()
+    idled_out = False
+
+    def check_idle():
+        nonlocal idle_timer, idled_out
+        idle_deadline = last_frame + 6
+        if loop.time() < idle_deadline:
+            # Data arrived since this check was armed; re-arm from that frame
+            idle_timer = loop.call_at(idle_deadline, check_idle)
+        elif total_bytes > 50_000:
+            # No data for 6 seconds and we have some data
+            idled_out = True
+            task.cancel()
+        else:
+            # Idle but not enough data yet; keep waiting for output
+            idle_timer = loop.call_later(3, check_idle)
+
+    async def collect_output():
+        nonlocal total_bytes, end_time, last_frame
+        # Sliding window over the last bytes of output, so a prompt split
+        # across frames is still seen without keeping the whole stream
+        tail = bytearray()
+        recv = ws.recv
+        bytes_type = bytes
+        now = loop.time
+        prompt_search = PROMPT_RE.search
+        frames = 0
+        while True:
+            msg = await recv()
+            last_frame = now()
+            # Yield periodically so the idle watchdog timer stays serviced
+            frames += 1
+            if frames % YIELD_EVERY == 0:
+                await asyncio.sleep(0)
+
+            if type(msg) is bytes_type and msg[:1] == b"0":
+                total_bytes += len(msg) - 1
+                tail += memoryview(msg)[max(1, len(msg) - 256) :]
+                del tail[:-256]
+                # Detect prompt return (command finished)
+                if total_bytes > 50_000 and prompt_search(tail):
+                    end_time = time.perf_counter()
+                    return
+
+    idle_timer = loop.call_at(last_frame + 6, check_idle)
+    try:
+        async with asyncio.timeout(60):
+            await collect_output()
+    except asyncio.TimeoutError:
+        end_time = time.perf_counter()
+    except asyncio.CancelledError:
+        if not idled_out:
+            raise
+        task.uncancel()
+        end_time = time.perf_counter()
+    finally:
+        idle_timer.cancel()
+
+    if end_time and total_bytes > 50_000:
         elapsed = end_time - start_time
         kbs = (total_bytes / 1024) / elapsed
-        result = {
+        return {
             "test": "throughput",
             "total_bytes": total_bytes,
             "elapsed_seconds": round(elapsed, 3),
             "throughput_kbs": round(kbs, 2),
         }
-        print(json.dumps(result, indent=2))
-    else:
-        print(
-            json.dumps({"error": "timeout or incomplete", "total_bytes": total_bytes})
-        )
+    return {"error": "timeout or incomplete", "total_bytes": total_bytes}
+
+
+async def run_benchmark():
+    async with connect(max_size=10 * 1024 * 1024) as ws:
+        await send_init(ws)
+        await await_prompt(ws)
+        result = await bench(ws)
+    write_result(result)
 
 
 if __name__ == "__main__":
+    pin_client_cpu()
     asyncio.run(run_benchmark())